@@ -1,37 +1,62 @@
 # coding: utf-8
 import sys
+import csv
 import contextlib
 import numpy as np
-import pandas as pd
 import xlsxwriter
 from datetime import datetime
 from PyQt5.QtWidgets import (QWidget, QDesktopWidget, QApplication, 
     QFileDialog, QPushButton, QGridLayout, QLabel, QLineEdit, QComboBox,
     QListView, QGroupBox, QTableView, QHBoxLayout, QVBoxLayout,
-    QFormLayout, QCheckBox)
-from PyQt5.QtCore import pyqtSlot, QAbstractTableModel, Qt, QModelIndex
+    QFormLayout, QCheckBox, QHeaderView, QProgressBar, QStyle)
+from PyQt5.QtCore import (pyqtSlot, pyqtSignal, QObject, QThread,
+    QAbstractTableModel, QAbstractListModel, Qt, QModelIndex)
 from PyQt5.QtGui import QPalette
-from arrivista_db import Base, Magazine, Issue, Numbering
-from sqlalchemy import create_engine, MetaData, desc
-from sqlalchemy.orm import sessionmaker
-from collections import namedtuple
+from arrivista_db import Base, Magazine, Issue, Numbering, extract_issue_numbers
+from sqlalchemy import create_engine, event, MetaData, desc, and_, func, select, insert, update, delete
+from sqlalchemy.orm import sessionmaker, contains_eager
+from sqlalchemy.pool import QueuePool
+from collections import namedtuple, defaultdict
+from operator import attrgetter
 
 APPLICATION_TITLE = "L'Arrivista"
 DB_FILENAME = "arrivista.db"
 DEFAULT_NUMBER_PREFIX = "n° "
+FETCH_BATCH_SIZE = 200
+COLUMN_SIZE_SAMPLE_ROWS = 50
+COLUMN_PADDING = 24
+CSV_BUFFER_SIZE = 1 << 20
+EXPORT_BATCH_SIZE = 500
+TITLE_FORMAT = {'bold': True, 'font_size': 18}
+BOLD_FORMAT = {'bold': True}
+ITALIC_FORMAT = {'italic': True}
 ControlGroup = namedtuple('ControlGroup', 'group tasks')
-
-def getattr_rec(obj, attr):
-    dot_pos = attr.find('.')
-    if dot_pos > -1:
-        return getattr_rec(getattr(obj, attr[:dot_pos]), attr[dot_pos+1:])
-    return getattr(obj, attr)
-
-def setattr_rec(obj, attr, val):
-    dot_pos = attr.find('.')
-    if dot_pos > -1:
-        setattr_rec(getattr(obj, attr[:dot_pos]), attr[dot_pos+1:], val)
-    setattr(obj, attr, val)
+MagazineName = namedtuple('MagazineName', 'id name')
+
+# statements executed repeatedly, built once so that their compiled form is reused
+ALL_MAGAZINES = select(Magazine)
+ALL_ISSUES = select(Issue)
+DELETE_NEW_ISSUES = delete(Issue).where(Issue.is_new == True).execution_options(synchronize_session=False)
+MAGAZINE_IDS = select(Magazine.name, Magazine.id)
+MAGAZINE_NAMES = select(Magazine.id, Magazine.name).order_by(Magazine.name)
+ISSUE_KEYS = select(Issue.magazine_id, Issue.year, Issue.issue_number, Issue.id, Issue.is_new)
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.execute('PRAGMA cache_size=-65536')
+    # sorts and temporary b-trees (ORDER BY on non indexed columns) stay in memory
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+def make_setter(attr):
+    parent_path, _, name = attr.rpartition('.')
+    if len(parent_path) == 0:
+        return lambda obj, val: setattr(obj, name, val)
+    get_parent = attrgetter(parent_path)
+    return lambda obj, val: setattr(get_parent(obj), name, val)
 
 def ignore_exception(ignore_exception=Exception, default_value=None):
     def dec(function):
@@ -46,6 +71,63 @@ def ignore_exception(ignore_exception=Exception, default_value=None):
 def try_parse(type_func, value, default_value=None):
     return ignore_exception(default_value=None)(type_func)(value)
 
+def write_issues_workbook(manager, stmt, file_path, tree_structure=False):
+    # runs in an export thread, so it needs its own session
+    session = manager.Session()
+    try:
+        workbook = xlsxwriter.Workbook(file_path, {'constant_memory': True})
+        worksheet = workbook.add_worksheet()
+
+        bold = workbook.add_format(BOLD_FORMAT)
+        italic = workbook.add_format(ITALIC_FORMAT)
+
+        cur_mag, cur_year = None, None
+
+        for row, issue in enumerate(session.execute(stmt).scalars()):
+            if not tree_structure or cur_mag is None or issue.magazine_id != cur_mag:
+                worksheet.write_string(row, 0, issue.magazine.name, bold)
+                cur_mag = issue.magazine_id
+                cur_year = None
+            if not tree_structure or cur_year is None or issue.year != cur_year:
+                cur_year = issue.year
+                worksheet.write_string(row, 1, '-' if issue.year is None else str(issue.year), italic)
+            worksheet.write_string(row, 2, str(issue.issue_number))
+            worksheet.write_number(row, 3, issue.copies)
+
+        workbook.close()
+    finally:
+        session.close()
+
+def write_missing_numbers_workbook(file_path, magazine_name, data):
+    # constant_memory writes rows in order: title, then header, then the numbers
+    workbook = xlsxwriter.Workbook(file_path, {'constant_memory': True})
+    worksheet = workbook.add_worksheet()
+
+    title = workbook.add_format(TITLE_FORMAT)
+    bold = workbook.add_format(BOLD_FORMAT)
+    italic = workbook.add_format(ITALIC_FORMAT)
+
+    show_year = any(item[0] is not None for item in data)
+
+    worksheet.write_string(0, 0, magazine_name + ' - numeri mancanti', title)
+
+    cur_year, row, number_col = None, 3, 1 if show_year else 0
+
+    if show_year:
+        worksheet.write_string(2, 0, 'anno', bold)
+
+    worksheet.write_string(2, number_col, 'numero', bold)
+
+    for (year, number) in data:
+        if cur_year is None or year != cur_year:
+            cur_year = year
+            worksheet.write_string(row, 0, '-' if year is None else str(year), italic)
+        worksheet.write_string(row, number_col, str(number))
+        row += 1
+
+    workbook.close()
+
+
 class ArrivistaTableModel(QAbstractTableModel):
 
     def __init__(self, manager, model, parent=None, filter=None, add_empty_row=False, sort_column=None, sort_order=Qt.AscendingOrder):
@@ -53,6 +135,12 @@ class ArrivistaTableModel(QAbstractTableModel):
         self.manager = manager
         self.session = manager.Session()
         self.model = model
+        self.getters = [attrgetter(column) for column in model.show_columns]
+        self.setters = [make_setter(column) for column in model.show_columns]
+        self.column_count = len(model.show_columns)
+        self.column_names = tuple(model.column_names)
+        self.column_flags = tuple(Qt.ItemFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable | (Qt.ItemIsEditable if editable else 0))
+            for editable in model.edit_columns)
         self.sort_column = sort_column
         self.sort_order = sort_order
         self.filter = filter
@@ -60,6 +148,14 @@ class ArrivistaTableModel(QAbstractTableModel):
         self.current_filter = filter
         self.add_empty_row = add_empty_row
         self.raw_data = []
+        # displayed values of raw_data, so that painting never touches the orm objects
+        self.rows = []
+        self.statement = None
+        self.count_statement = None
+        self.fetched_count = 0
+        self.total_count = 0
+        # manager.cache_version when the session was opened, the rows it loads are valid until it changes
+        self.loaded_version = manager.cache_version
         self.refresh()
 
     def _update_current_filter(self):
@@ -68,67 +164,104 @@ class ArrivistaTableModel(QAbstractTableModel):
         elif self.filter is None:
             self.current_filter = self.add_filter
         else:
-            self.current_filter = lambda x: self.filter(x) and self.add_filter(x)
+            self.current_filter = and_(self.filter, self.add_filter)
+        self.statement = None
 
     def setFilter(self, filter):
         self.add_filter = filter
         self._update_current_filter()
-        self.refresh(True)
+        self.beginResetModel()
+        self.refresh()
+        self.endResetModel()
 
     def resetFilter(self):
         self.setFilter(None)
 
-    def refresh(self, notify=False):
-        if notify:
-            old_count = self.rowCount()
-        if self.sort_column is None:
-            if self.current_filter is None:
-                self.raw_data = list(self.session.query(self.model))
-            else:
-                self.raw_data = list(d for d in self.session.query(self.model) if self.current_filter(d))
-        else:
-            q = self.session.query(self.model)
+    def _build_statements(self):
+        stmt = self.getFilteredStatement()
+        count_stmt = select(func.count(self.model.id))
+        if self.current_filter is not None:
+            count_stmt = count_stmt.where(self.current_filter)
+        if self.sort_column is not None:
             joined_table = self.model.joined_tables[self.sort_column]
             if joined_table is not None:
-                q = q.join(joined_table)
+                stmt = stmt.join(joined_table)
             col = self.model.sort_fields[self.sort_column]
-            q = q.order_by(col if self.sort_order == Qt.AscendingOrder else desc(col))
-            if self.current_filter is None:
-                self.raw_data = list(q)
-            else:
-                self.raw_data = list(d for d in q if self.current_filter(d))
+            stmt = stmt.order_by(col if self.sort_order == Qt.AscendingOrder else desc(col))
+        # order by id as well, so that batches fetched with offset are stable
+        self.statement = stmt.order_by(self.model.id)
+        self.count_statement = count_stmt
+
+    def _fetch(self, offset, limit):
+        stmt = self.statement.offset(offset)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        return self.session.execute(stmt).scalars().all()
+
+    def _to_row(self, obj):
+        return tuple(getter(obj) for getter in self.getters)
+
+    def refresh(self, recount=True):
+        if self.loaded_version != self.manager.cache_version:
+            # something was written since the last load, the identity map of this session may be stale
+            self.session.close()
+            self.session = self.manager.Session()
+            self.loaded_version = self.manager.cache_version
+        if self.statement is None:
+            self._build_statements()
+        if recount:
+            self.total_count = self.session.execute(self.count_statement).scalar()
+        self.raw_data = self._fetch(0, FETCH_BATCH_SIZE)
+        self.rows = [self._to_row(obj) for obj in self.raw_data]
+        self.fetched_count = len(self.raw_data)
         if self.add_empty_row:
             self.raw_data = [self.model()] + self.raw_data
-        if notify:
-            new_count = self.rowCount()
-            if old_count < new_count:
-                self.beginInsertRows(QModelIndex(), old_count, new_count-1)
-                self.endInsertRows()
-            elif old_count > new_count:
-                self.beginRemoveRows(QModelIndex(), new_count, old_count-1)
-                self.endRemoveRows()
-            self.dataChanged.emit(self.createIndex(0, 0), self.createIndex(self.rowCount()-1, self.columnCount()-1))
+            self.rows = [(None,) * self.column_count] + self.rows
+
+    def _emit_row_change(self, row):
+        self.dataChanged.emit(self.createIndex(row, 0), self.createIndex(row, self.columnCount()-1))
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return self.fetched_count < self.total_count
+
+    def fetchMore(self, parent=QModelIndex(), limit=FETCH_BATCH_SIZE):
+        if not self.canFetchMore(parent):
+            return
+        rows = self._fetch(self.fetched_count, limit)
+        if len(rows) == 0:
+            # some rows have been deleted in the meantime
+            self.total_count = self.fetched_count
+            return
+        first = len(self.raw_data)
+        self.beginInsertRows(QModelIndex(), first, first+len(rows)-1)
+        self.raw_data += rows
+        self.rows += [self._to_row(obj) for obj in rows]
+        self.fetched_count += len(rows)
+        self.endInsertRows()
+
+    def fetchAll(self):
+        self.fetchMore(limit=None)
 
     def rowCount(self, parent=None):
         return len(self.raw_data)
 
     def columnCount(self, parent=None):
-        return len(self.model.show_columns)
+        return self.column_count
 
     def data(self, index, role):
-        if index.row() >= self.rowCount():
+        if role != Qt.DisplayRole or index.row() >= len(self.rows):
             return None
-        if role == Qt.DisplayRole:
-            return getattr_rec(self.raw_data[index.row()], self.model.show_columns[index.column()])
-        return None
+        return self.rows[index.row()][index.column()]
 
     def headerData(self, section, orientation, role):
         if role != Qt.DisplayRole:
             return None
         if orientation == Qt.Horizontal:
-            if section >= self.columnCount():
+            if section >= self.column_count:
                 return None
-            return self.model.column_names[section]
+            return self.column_names[section]
         if orientation == Qt.Vertical:
             if section >= self.rowCount():
                 return None
@@ -136,10 +269,7 @@ class ArrivistaTableModel(QAbstractTableModel):
         return None
 
     def flags(self, index):
-        f = Qt.ItemIsEnabled + Qt.ItemIsSelectable
-        if self.model.edit_columns[index.column()]:
-            f += Qt.ItemIsEditable
-        return Qt.ItemFlags(f)
+        return self.column_flags[index.column()]
 
     def setData(self, index, value, role):
         if role != Qt.EditRole:
@@ -147,28 +277,49 @@ class ArrivistaTableModel(QAbstractTableModel):
         if index.column() >= self.columnCount() or index.row() >= self.rowCount():
             return False
         try:
-            setattr_rec(self.raw_data[index.row()], self.model.show_columns[index.column()], value)
+            obj = self.raw_data[index.row()]
+            self.setters[index.column()](obj, value)
             self.session.commit()
-            self.dataChanged.emit(index, index)
+            self.rows[index.row()] = self._to_row(obj)
+            self.manager.invalidate_cache()
+            self._emit_row_change(index.row())
             return True
         except:
             self.session.rollback()
             return False
 
     def sort(self, column, order):
+        if column == self.sort_column and order == self.sort_order:
+            return
         self.sort_column = column
         self.sort_order = order
-        self.refresh(True)
+        self.statement = None
+        self.beginResetModel()
+        # the order changes, not the matching rows: count them again only if something was written
+        self.refresh(recount=self.loaded_version != self.manager.cache_version)
+        self.endResetModel()
 
     def cloneData(self):
+        self.fetchAll()
         return list(self.raw_data)
 
     def getRawData(self):
         return self.raw_data
 
+    def getFilteredStatement(self):
+        stmt = select(self.model)
+        if self.current_filter is not None:
+            stmt = stmt.where(self.current_filter)
+        return stmt
+
     def resetConnection(self):
-        self.session = self.manager.Session()
-        self.refresh(True)
+        # nothing has been written since the last refresh, the loaded rows are still valid
+        if self.loaded_version == self.manager.cache_version:
+            return
+        # every row may have changed, not just their number
+        self.beginResetModel()
+        self.refresh()
+        self.endResetModel()
         
 
 class MissingNumbersTableModel(QAbstractTableModel):
@@ -180,29 +331,41 @@ class MissingNumbersTableModel(QAbstractTableModel):
         self.magazine_id = None
         self.magazine = None
         self.raw_data = []
+        # missing numbers are computed all at once, but handed to the view in batches
+        self.fetched_count = 0
+        # manager.cache_version when the session was opened, the missing numbers it computes are valid until it changes
+        self.loaded_version = manager.cache_version
         self.refresh()
 
-    def refresh(self, notify=False):
-        if notify:
-            old_count = self.rowCount()
+    def refresh(self):
+        if self.loaded_version != self.manager.cache_version:
+            # something was written since the last load, the identity map of this session may be stale
+            self.session.close()
+            self.session = self.manager.Session()
+            self.loaded_version = self.manager.cache_version
         if self.magazine_id is None:
             self.raw_data = []
             self.magazine = None
         else:
-            self.magazine = self.session.query(Magazine).get(self.magazine_id)
+            self.magazine = self.session.get(Magazine, self.magazine_id)
             self.raw_data = self.magazine.get_missing_numbers()
-        if notify:
-            new_count = self.rowCount()
-            if old_count < new_count:
-                self.beginInsertRows(QModelIndex(), old_count, new_count-1)
-                self.endInsertRows()
-            elif old_count > new_count:
-                self.beginRemoveRows(QModelIndex(), new_count, old_count-1)
-                self.endRemoveRows()
-            self.dataChanged.emit(self.createIndex(0, 0), self.createIndex(self.rowCount()-1, self.columnCount()-1))        
+        self.fetched_count = min(len(self.raw_data), FETCH_BATCH_SIZE)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return self.fetched_count < len(self.raw_data)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        new_count = min(len(self.raw_data), self.fetched_count + FETCH_BATCH_SIZE)
+        self.beginInsertRows(QModelIndex(), self.fetched_count, new_count-1)
+        self.fetched_count = new_count
+        self.endInsertRows()
 
     def rowCount(self, parent=None):
-        return len(self.raw_data)
+        return self.fetched_count
 
     def columnCount(self, parent=None):
         return 2
@@ -229,7 +392,9 @@ class MissingNumbersTableModel(QAbstractTableModel):
 
     def setMagazineId(self, magazine_id):
         self.magazine_id = magazine_id
-        self.refresh(notify=True)
+        self.beginResetModel()
+        self.refresh()
+        self.endResetModel()
         
     def resetMagazineId(self):
         self.setMagazineId(None)
@@ -241,67 +406,199 @@ class MissingNumbersTableModel(QAbstractTableModel):
         return self.raw_data
 
     def resetConnection(self):
-        self.session = self.manager.Session()
-        self.refresh(True)
+        # nothing has been written since the last refresh, the loaded rows are still valid
+        if self.loaded_version == self.manager.cache_version:
+            return
+        # every row may have changed, not just their number
+        self.beginResetModel()
+        self.refresh()
+        self.endResetModel()
         
 
+class MagazineListModel(QAbstractListModel):
+
+    def __init__(self, manager, parent=None, filter=None, add_empty_row=False):
+        super().__init__(parent)
+        self.manager = manager
+        self.filter = filter
+        self.add_empty_row = add_empty_row
+        self.raw_data = []
+        self.refresh()
+
+    def refresh(self, notify=False):
+        if notify:
+            old_count = self.rowCount()
+        self.raw_data = self.manager.load_magazine_names(filter=self.filter)
+        if self.add_empty_row:
+            self.raw_data = [MagazineName(None, None)] + self.raw_data
+        if notify:
+            new_count = self.rowCount()
+            if old_count < new_count:
+                self.beginInsertRows(QModelIndex(), old_count, new_count-1)
+                self.endInsertRows()
+            elif old_count > new_count:
+                self.beginRemoveRows(QModelIndex(), new_count, old_count-1)
+                self.endRemoveRows()
+
+    def rowCount(self, parent=None):
+        return len(self.raw_data)
+
+    def data(self, index, role):
+        if role != Qt.DisplayRole or index.row() >= len(self.raw_data):
+            return None
+        return self.raw_data[index.row()].name
+
+    def getRawData(self):
+        return self.raw_data
+
+    def resetConnection(self):
+        self.refresh(True)
+
+
+class ImportWorker(QObject):
+
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(int, int, int, int)
+    failed = pyqtSignal(str)
+
+    def __init__(self, manager, file_path):
+        super().__init__()
+        self.manager = manager
+        self.file_path = file_path
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            result = self.manager.update_archive_from_csv(self.file_path, progress=self.progress.emit)
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.finished.emit(*result)
+
+
+class ExportWorker(QObject):
+
+    finished = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, export_function, *args):
+        super().__init__()
+        self.export_function = export_function
+        self.args = args
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            self.export_function(*self.args)
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.finished.emit()
+
+
 class ArchiveManager:
 
     def __init__(self, filename):
-        self.engine = create_engine('sqlite:///' + filename)
+        # sessions (one per table model, plus the csv import thread) check out pooled connections,
+        # which may be handed to a different thread the next time
+        self.engine = create_engine('sqlite:///' + filename, query_cache_size=1200,
+            poolclass=QueuePool, pool_size=8, connect_args={'check_same_thread': False})
+        event.listen(self.engine, 'connect', set_sqlite_pragmas)
         Base.metadata.create_all(self.engine)
+        # create_all skips existing tables, add indexes introduced later to older archives
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
         self.Session = sessionmaker(bind=self.engine)
-        self.meta = MetaData(bind=self.engine)
-        self.meta.reflect()
-
-    def update_archive_from_csv(self, csv_path):
-
-        m = pd.read_csv(str(csv_path)).as_matrix()
-
-        # first retrieve all new magazines
-        magazine_names = sorted(set(m[:,0]))
-        magazines = self.load_magazine_dict()
-        new_magazines = [Magazine(name=n) for n in magazine_names if magazines.get(n) is None]
+        self.meta = MetaData()
+        self.meta.reflect(bind=self.engine)
+        # results of the load_* methods, valid as long as cache_version does not change
+        self.cache_version = 0
+        self._cached_version = None
+        self._cache_session = None
+        self._cache = {}
+
+    def invalidate_cache(self):
+        self.cache_version += 1
+
+    def _cached(self, key, session, load):
+        if session is not None:
+            return load(session)
+        if self._cached_version != self.cache_version:
+            if self._cache_session is not None:
+                self._cache_session.close()
+            self._cache_session = self.Session()
+            self._cached_version = self.cache_version
+            self._cache = {}
+        if key not in self._cache:
+            self._cache[key] = load(self._cache_session)
+        return self._cache[key]
+
+    def update_archive_from_csv(self, csv_path, progress=None):
+
+        def report(value):
+            if progress is not None:
+                progress(value)
 
         session = self.Session()
         try:
-            session.add_all(new_magazines)
-            magazines = self.load_magazine_dict(session=session)
-            issues = self.load_issue_dict(session=session, add_selection=True)
+            magazines = dict(session.execute(MAGAZINE_IDS).all())
+            # (magazine_id, year, issue_number) -> (id, is_new) for every archived issue
+            archived = {(mag_id, y, num): (issue_id, is_new)
+                for mag_id, y, num, issue_id, is_new in session.execute(ISSUE_KEYS)}
+            # issues in the catalogue, in file order
+            catalogue = {}
+            new_magazines = {}
+            with open(str(csv_path), newline='', encoding='utf-8', buffering=CSV_BUFFER_SIZE) as csv_file:
+                rows = csv.reader(csv_file)
+                next(rows, None) # skip header
+                for row in rows:
+                    if len(row) == 0:
+                        continue
+                    mag, y, num = row
+                    if mag not in magazines:
+                        new_magazines[mag] = None
+                    catalogue[(mag, try_parse(int, y), num)] = None
+            report(40)
+
             num_magazines = len(new_magazines)
-            issues_to_save = []
-            num_new_issues = 0
-            num_updated_issues = 0
-            for mag, y, num in m:
-                num = str(num)
-                current_magazine = magazines[mag]
-                if issues.get(current_magazine.id) is None:
-                    issues[current_magazine.id] = {}
-                if issues[current_magazine.id].get(y) is None:
-                    issues[current_magazine.id][y] = {}
-                if issues[current_magazine.id][y].get(num) is None:
-                    issue = Issue(magazine=current_magazine, year=y, issue_number=str(num), is_new=False, copies=1)
-                    issue.populate_issue_numbers()
-                    issues[current_magazine.id][y][num] = [issue, True]
-                    issues_to_save.append(issue)
-                    num_new_issues += 1
-                else:
-                    issue_tuple = issues[current_magazine.id][y][num]
-                    issue_tuple[1] = True # issue is still there
-                    if issue_tuple[0].is_new:
-                        issue_tuple[0].is_new = False
-                        issues_to_save.append(issue_tuple[0])
-                        num_updated_issues += 1
-            session.add_all(issues_to_save)
-            issues_to_delete = [issue_tuple[0] for mag_id, mag in issues.items() 
-                for y, y_list in mag.items() 
-                for _, issue_tuple in y_list.items() if issue_tuple[1] is False]
-            num_deleted_issues = len(issues_to_delete)
-
-            for x in issues_to_delete:
-                session.delete(x)
+            if new_magazines:
+                session.execute(insert(Magazine), [{'name': mag} for mag in new_magazines])
+                magazines = dict(session.execute(MAGAZINE_IDS).all())
+            catalogue = {(magazines[mag], y, num): None for (mag, y, num) in catalogue}
+            report(50)
+
+            new_issues = []
+            # issue numbers repeat a lot across magazines and years: parse each string once
+            parsed_numbers = {}
+            for (magazine_id, y, num) in catalogue:
+                if (magazine_id, y, num) not in archived:
+                    numbers = parsed_numbers.get(num)
+                    if numbers is None:
+                        numbers = parsed_numbers[num] = extract_issue_numbers(num)
+                    num_min, num_max, inv, suffix = numbers
+                    new_issues.append({'magazine_id': magazine_id, 'year': y, 'issue_number': num,
+                        'is_new': False, 'copies': 1, 'num_min': num_min, 'num_max': num_max, 'inv': inv, 'suffix': suffix})
+            ids_to_update = [archived[key][0] for key in catalogue.keys() & archived.keys() if archived[key][1]]
+            ids_to_delete = [archived[key][0] for key in archived.keys() - catalogue.keys()]
+            num_new_issues = len(new_issues)
+            num_updated_issues = len(ids_to_update)
+            num_deleted_issues = len(ids_to_delete)
+            report(60)
+
+            if new_issues:
+                session.execute(insert(Issue), new_issues)
+            report(80)
+            if ids_to_update:
+                session.execute(update(Issue).where(Issue.id.in_(ids_to_update)).values(is_new=False)
+                    .execution_options(synchronize_session=False))
+            if ids_to_delete:
+                session.execute(delete(Issue).where(Issue.id.in_(ids_to_delete))
+                    .execution_options(synchronize_session=False))
 
             session.commit()
+            self.invalidate_cache()
+            report(100)
             return num_magazines, num_new_issues, num_updated_issues, num_deleted_issues
         except:
             session.rollback()
@@ -314,89 +611,119 @@ class ArchiveManager:
                 for table in reversed(self.meta.sorted_tables):
                     con.execute(table.delete())
                 trans.commit()
+                self.invalidate_cache()
             except:
                 trans.rollback()
                 raise
 
     def delete_new_issues(self):
-        session = self.Session()
-        try:
-            for issue in session.query(Issue).filter_by(is_new = True):
-                session.delete(issue)
-            session.commit()
-        except:
-            session.rollback()
-            raise
+        with self.Session.begin() as session:
+            session.execute(DELETE_NEW_ISSUES)
+        self.invalidate_cache()
 
     def insert(self, obj):
-        session = self.Session()
-        try:
+        # the inserted objects outlive the session, keep their loaded attributes readable
+        with self.Session(expire_on_commit=False) as session, session.begin():
             session.add(obj)
-            session.commit()
-        except:
-            session.rollback()
-            raise
+        self.invalidate_cache()
         
     def insert_all(self, obj_list):
-        session = self.Session()
-        try:
+        with self.Session(expire_on_commit=False) as session, session.begin():
             session.add_all(obj_list)
-            session.commit()
-        except:
-            session.rollback()
-            raise
+        self.invalidate_cache()
 
     def load_magazine_list(self, session=None):
-        if session is None:
-            session = self.Session()
-        return list(session.query(Magazine))
+        return self._cached('magazine_list', session,
+            lambda s: s.execute(ALL_MAGAZINES).scalars().all())
         
     def load_magazine_dict(self, session=None):
-        return {mag.name: mag for mag in self.load_magazine_list(session=session)}
+        return self._cached('magazine_dict', session,
+            lambda s: {mag.name: mag for mag in self.load_magazine_list(session=s)})
+
+    def load_magazine_names(self, session=None, filter=None):
+        stmt = MAGAZINE_NAMES if filter is None else MAGAZINE_NAMES.where(filter)
+        return self._cached(('magazine_names', filter), session,
+            lambda s: [MagazineName(*row) for row in s.execute(stmt)])
 
     def load_issue_list(self, session=None):
-        if session is None:
-            session = self.Session()
-        return list(session.query(Issue))
+        return self._cached('issue_list', session,
+            lambda s: s.execute(ALL_ISSUES).scalars().all())
         
-    def load_issue_dict(self, session=None, add_selection=False):
-        issue_list = self.load_issue_list(session=session)
-        magazine_ids = set([issue.magazine_id for issue in issue_list])
-        issues_for_magazines = {magazine_id: [issue for issue in issue_list
-            if issue.magazine_id==magazine_id] for magazine_id in magazine_ids}
-        years_for_magazines = {magazine_id: set([issue.year for issue in issues_for_magazines[magazine_id]]) 
-            for magazine_id in magazine_ids}
-        if add_selection:
-            return {magazine_id: {year: {issue.issue_number: [issue, False] for issue in issues_for_magazines[magazine_id] 
-                if issue.year==year} 
-                for year in years_for_magazines[magazine_id]} for magazine_id in magazine_ids}
-        return {magazine_id: {year: {issue.issue_number: issue for issue in issues_for_magazines[magazine_id] 
-            if issue.year==year} 
-            for year in years_for_magazines[magazine_id]} for magazine_id in magazine_ids}        
+    def load_issue_dict(self, session=None):
+        return self._cached('issue_dict', session, self._build_issue_dict)
+
+    def _build_issue_dict(self, session):
+        issues = defaultdict(lambda: defaultdict(dict))
+        for issue in self.load_issue_list(session=session):
+            issues[issue.magazine_id][issue.year][issue.issue_number] = issue
+        return {magazine_id: dict(years) for magazine_id, years in issues.items()}
 
 
 class Arrivista(QWidget):
 
+    SIDEBAR_BUTTON_STYLE = "background-color: #AAAAAA; border: 1px solid; padding: 5px; margin: 2px;"
+    SIDEBAR_BUTTON_HIGHLIGHT_STYLE = "background-color: #55BCDD; border: 1px solid; padding: 5px; margin: 2px;"
+
     def __init__(self, manager, title):
         super().__init__()
         self.manager = manager
         self.groups = {}
+        self.highlightedButton = None
+        self.importThread = None
+        self.exportThreads = {}
+        # shared by all the export buttons
+        self.exportIcon = self.style().standardIcon(QStyle.SP_DialogSaveButton)
         self._initUI(title)
 
     def _showGroup(self, group_to_show, button_to_highlight=None):
-        for controlGroup in self.groups:
-            if controlGroup.group == group_to_show:
-                controlGroup.group.setVisible(True)
-                for task in controlGroup.tasks:
-                    task()
-            else:
-                controlGroup.group.setVisible(False)
-        for sidebarButton in self.sidebarButtons:
-            if sidebarButton == button_to_highlight:
-                sidebarButton.setStyleSheet("background-color: #55BCDD; border: 1px solid; padding: 5px; margin: 2px;")
-            else:
-                sidebarButton.setStyleSheet("background-color: #AAAAAA; border: 1px solid; padding: 5px; margin: 2px;")
-            sidebarButton.update()
+        self.setUpdatesEnabled(False)
+        try:
+            if group_to_show not in self.groups:
+                self._buildGroup(group_to_show)
+            for group_name, controlGroup in self.groups.items():
+                if group_name == group_to_show:
+                    controlGroup.group.setVisible(True)
+                    for task in controlGroup.tasks:
+                        task()
+                else:
+                    controlGroup.group.setVisible(False)
+            if button_to_highlight != self.highlightedButton:
+                if self.highlightedButton is not None:
+                    self.highlightedButton.setStyleSheet(self.SIDEBAR_BUTTON_STYLE)
+                if button_to_highlight is not None:
+                    button_to_highlight.setStyleSheet(self.SIDEBAR_BUTTON_HIGHLIGHT_STYLE)
+                self.highlightedButton = button_to_highlight
+        finally:
+            self.setUpdatesEnabled(True)
+
+    def _setupTable(self, table, model, sorting_enabled=True):
+        table.setSortingEnabled(sorting_enabled)
+        table.setModel(model)
+        # size columns once, and let the user resize them afterwards
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        self._sizeColumns(table, model)
+
+    def _sizeColumns(self, table, model):
+        # measure the header and the first few rows only, instead of every loaded row
+        metrics = table.fontMetrics()
+        header_metrics = table.horizontalHeader().fontMetrics()
+        rows = min(model.rowCount(), COLUMN_SIZE_SAMPLE_ROWS)
+        for column in range(model.columnCount()):
+            width = header_metrics.horizontalAdvance(str(model.headerData(column, Qt.Horizontal, Qt.DisplayRole)))
+            for row in range(rows):
+                value = model.data(model.index(row, column), Qt.DisplayRole)
+                if value is not None:
+                    width = max(width, metrics.horizontalAdvance(str(value)))
+            table.setColumnWidth(column, width + COLUMN_PADDING)
+
+    def _refreshTableSignal(self, table, model):
+        def dummy():
+            table.setUpdatesEnabled(False)
+            try:
+                model.resetConnection()
+            finally:
+                table.setUpdatesEnabled(True)
+        return dummy
 
     def _showGroupSignal(self, group_to_show, button_to_highlight=None):
         def dummy():
@@ -414,38 +741,17 @@ class Arrivista(QWidget):
     def _exportData(self, model_to_export, tree_structure=False, default_filename=''):
         file_path = self._getExportFilePath(default_filename)
         if file_path:
-            try:
+            if model_to_export.total_count == 0:
+                self._messageBox('Nessun dato da esportare')
+                return
+
+            stmt = model_to_export.getFilteredStatement() \
+                .join(Issue.magazine) \
+                .options(contains_eager(Issue.magazine)) \
+                .order_by(Magazine.name, Issue.year, Issue.issue_number) \
+                .execution_options(yield_per=EXPORT_BATCH_SIZE)
 
-                data = model_to_export.cloneData()
-                data.sort(key=lambda x: (x.magazine.name, 0 if x.year is None else x.year, x.issue_number))
-                
-                if len(data) == 0:
-                    self._messageBox('Nessun dato da esportare')
-                    return
-
-                workbook = xlsxwriter.Workbook(file_path)
-                worksheet = workbook.add_worksheet()
-
-                bold = workbook.add_format({'bold': True})
-                italic = workbook.add_format({'italic': True})
-
-                cur_mag, cur_year = None, None
-
-                for (issue, row) in zip(data, range(len(data))):
-                    if not tree_structure or cur_mag is None or issue.magazine_id != cur_mag:
-                        worksheet.write(row, 0, issue.magazine.name, bold)
-                        cur_mag = issue.magazine_id
-                        cur_year = None
-                    if not tree_structure or cur_year is None or issue.year != cur_year:
-                        cur_year = issue.year
-                        worksheet.write(row, 1, '-' if issue.year is None else str(issue.year), italic)
-                    worksheet.write(row, 2, str(issue.issue_number))
-                    worksheet.write(row, 3, issue.copies)
-
-                workbook.close()
-            except Exception as e:
-                print(e)
-                pass
+            self._startExport(write_issues_workbook, self.manager, stmt, file_path, tree_structure)
 
     def _exportDataSignal(self, model_to_export, export_method, **kwargs):
         def dummy():
@@ -456,59 +762,82 @@ class Arrivista(QWidget):
         default_filename = model_to_export.magazine.name + default_filename
         file_path = self._getExportFilePath(default_filename)
         if file_path:
-            try:
-
-                data = model_to_export.cloneData()
-                
-                if len(data) == 0:
-                    self._messageBox('Nessun dato da esportare')
-                    return
-
-                workbook = xlsxwriter.Workbook(file_path)
-                worksheet = workbook.add_worksheet()
-
-                title = workbook.add_format({'bold': True, 'font_size': 18})
-                bold = workbook.add_format({'bold': True})
-                italic = workbook.add_format({'italic': True})
-
-                show_year = any(item[0] is not None for item in data)
-
-                worksheet.write(0, 0, model_to_export.magazine.name + ' - numeri mancanti', title)
+            data = model_to_export.cloneData()
 
-                cur_year, row, number_col = None, 3, 1 if show_year else 0
-                
-                if show_year:
-                    worksheet.write(2, 0, 'anno', bold)
+            if len(data) == 0:
+                self._messageBox('Nessun dato da esportare')
+                return
 
-                worksheet.write(2, number_col, 'numero', bold)
+            self._startExport(write_missing_numbers_workbook, file_path, model_to_export.magazine.name, data)
 
-                for (year, number) in data:
-                    if cur_year is None or year != cur_year:
-                        cur_year = year
-                        worksheet.write(row, 0, '-' if year is None else str(year), italic)
-                    worksheet.write(row, number_col, str(number))
-                    row += 1
-
-                workbook.close()
-            except Exception as e:
-                print(e)
-                pass
-
-    def _exportMissingNumbersSignal(self, model_to_export, export_method, **kwargs):
-        def dummy():
-            export_method(model_to_export, **kwargs)
-        return dummy
+    def _makeExportButton(self, model_to_export, export_method, default_filename):
+        btnExport = QPushButton('Esporta')
+        btnExport.setIcon(self.exportIcon)
+        btnExport.clicked.connect(self._exportDataSignal(model_to_export, export_method, default_filename=default_filename))
+        return btnExport
+
+    def _startExport(self, export_function, *args):
+        # workbooks are written in a worker thread, several exports may run at the same time
+        thread = QThread(self)
+        worker = ExportWorker(export_function, *args)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.finished.connect(thread.quit, Qt.DirectConnection)
+        worker.failed.connect(thread.quit, Qt.DirectConnection)
+        worker.failed.connect(self._exportFailed)
+        # the worker is gone by the time the thread is over, the thread goes after _endExport
+        thread.finished.connect(worker.deleteLater)
+        thread.finished.connect(self._endExport)
+        thread.finished.connect(thread.deleteLater)
+        self.exportThreads[thread] = worker
+        thread.start()
+
+    @pyqtSlot(str)
+    def _exportFailed(self, error_message):
+        print(error_message)
+
+    @pyqtSlot()
+    def _endExport(self):
+        thread = self.sender()
+        thread.wait()
+        del self.exportThreads[thread]
 
     def _resetImportMessage(self):
-        self.importMessage.setText("Trascina qui il file .csv contenente il catalogo aggiornato.")
+        if self.importThread is None:
+            self.importMessage.setText("Trascina qui il file .csv contenente il catalogo aggiornato.")
+            self.importProgress.setVisible(False)
+
+    @pyqtSlot(int, int, int, int)
+    def _importFinished(self, m, ni, ui, di):
+        self.importMessage.setText("Importazione conclusa:\n{} nuove testate, {} nuovi numeri, {} numeri aggiornati e {} numeri eliminati.".format(m, ni, ui, di))
+        self._endImport()
+
+    @pyqtSlot(str)
+    def _importFailed(self, error_message):
+        self.importMessage.setText("Importazione non riuscita:\n{}".format(error_message))
+        self._endImport()
+
+    def _endImport(self):
+        self.importProgress.setVisible(False)
+        self.importThread.wait()
+        self.importThread = None
+        self.importWorker = None
+        self.setAcceptDrops(True)
 
     def _generateIssueFilter(self, magazine_combo=None, year_edit=None, number_edit=None):
         magazine_id = None if magazine_combo is None else magazine_combo.model().getRawData()[magazine_combo.currentIndex()].id
         year = None if year_edit is None else try_parse(int, year_edit.text())
         number = None if number_edit is None or len(number_edit.text()) == 0 else number_edit.text()
-        return lambda x: (magazine_id is None or x.magazine_id == magazine_id) \
-            and (year is None or x.year == year) \
-            and (number is None or x.issue_number.find(number) >= 0)
+        conditions = []
+        if magazine_id is not None:
+            conditions.append(Issue.magazine_id == magazine_id)
+        if year is not None:
+            conditions.append(Issue.year == year)
+        if number is not None:
+            conditions.append(Issue.issue_number.contains(number, autoescape=True))
+        if len(conditions) == 0:
+            return None
+        return and_(*conditions)
 
     def _applyFilter(self, model_to_filter, filter_generator, **kwargs):
         model_to_filter.setFilter(filter_generator(**kwargs))
@@ -598,109 +927,119 @@ class Arrivista(QWidget):
 
     def _createGroups(self, main_grid, row, col, rowspan, colspan):
 
-        # initialize group list
-        self.groups = []
-
-        #
-        # helper methods
-        #
-        def getFilterGroup(parent_model, allow_no_selection=True, filter_caption='Filtra', reset_insert_caption='Reimposta', 
-            add_filter=None, add_reset_insert=None, reset_insert_signal=self._resetFilterSignal):
-            formLayout = QFormLayout()
-            formLayout.setSpacing(10)
-
-            magazineModel = ArrivistaTableModel(self.manager, Magazine, add_empty_row=allow_no_selection, sort_column=0)
-
-            cmbMagazine = QComboBox()
-            cmbMagazine.setModel(magazineModel)
-            txtYear = QLineEdit()
-            txtNumber = QLineEdit()
-            btnFilter = QPushButton(filter_caption)
-            btnResetInsert = QPushButton(reset_insert_caption)
-
-            formLayout.addRow('Testata', cmbMagazine)
-            formLayout.addRow('Anno', txtYear)
-            formLayout.addRow('Numero', txtNumber)
-            formLayout.addRow(btnFilter, btnResetInsert)
-
-            formGroup = QGroupBox()
-            formGroup.setLayout(formLayout)
-
-            if add_filter is not None:
-                btnFilter.clicked.connect(add_filter)
-
-            btnFilter.clicked.connect(self._filterSignal(parent_model, 
-                self._generateIssueFilter, magazine_combo=cmbMagazine, year_edit=txtYear, number_edit=txtNumber))
-
-            if add_reset_insert is not None:
-                btnResetInsert.clicked.connect(add_reset_insert)
-
-            btnResetInsert.clicked.connect(reset_insert_signal(parent_model, 
-                magazine_combo=cmbMagazine, year_edit=txtYear, number_edit=txtNumber))
-
-            return formGroup, magazineModel
-
-        def getNumberingsFilterGroup(parent_model):
-            formLayout = QFormLayout()
-            formLayout.setSpacing(10)
-
-            magazineModel = ArrivistaTableModel(self.manager, Magazine, add_empty_row=True, sort_column=0)
-
-            cmbMagazine = QComboBox()
-            cmbMagazine.setModel(magazineModel)
-            txtYearFrom = QLineEdit()
-            txtYearTo = QLineEdit()
-            chkIsYearly = QCheckBox()
-            txtNumberFrom = QLineEdit()
-            txtNumberTo = QLineEdit()
-            btnFilter = QPushButton('Filtra')
-            btnInsert = QPushButton('Inserisci')
-
-            formLayout.addRow('Testata', cmbMagazine)
-            formLayout.addRow('Anno (da)', txtYearFrom)
-            formLayout.addRow('Anno (a)', txtYearTo)
-            formLayout.addRow('Numerazione annuale', chkIsYearly)
-            formLayout.addRow('Numero (da)', txtNumberFrom)
-            formLayout.addRow('Numero (a)', txtNumberTo)
-            formLayout.addRow(btnFilter, btnInsert)
-
-            formGroup = QGroupBox()
-            formGroup.setLayout(formLayout)
-
-            btnFilter.setVisible(False)
-            #btnFilter.clicked.connect(self._filterSignal(parent_model, 
-            #    self._generateIssueFilter, magazine_combo=cmbMagazine, year_edit=txtYear, number_edit=txtNumber))
-
-            btnInsert.clicked.connect(self._insertNumberingSignal(parent_model, 
-                magazine_combo=cmbMagazine, year_from_edit=txtYearFrom, year_to_edit=txtYearTo,
-                is_yearly_check=chkIsYearly, number_from_edit=txtNumberFrom, number_to_edit=txtNumberTo))
-
-            return formGroup, magazineModel
-
-        def getMissingNumbersFilterGroup(parent_model):
-            formLayout = QFormLayout()
-            formLayout.setSpacing(10)
-
-            magazineModel = ArrivistaTableModel(self.manager, Magazine, add_empty_row=True, sort_column=0, filter=lambda x: len(x.numberings) > 0)
-
-            cmbMagazine = QComboBox()
-            cmbMagazine.setModel(magazineModel)
-            cmbMagazine.currentIndexChanged.connect(self._selectedMagazineChanged)
-
-            formLayout.addRow('Testata', cmbMagazine)
-
-            formGroup = QGroupBox()
-            formGroup.setLayout(formLayout)
+        # groups are built the first time they are shown, all in the same grid position
+        self.groups = {}
+        self.groupGridPosition = (main_grid, row, col, rowspan, colspan)
+        self.groupBuilders = {
+            'welcome': self._buildWelcomeGroup,
+            'import': self._buildImportGroup,
+            'viewAll': self._buildViewAllGroup,
+            'viewDuplicates': self._buildViewDuplicatesGroup,
+            'viewNew': self._buildViewNewGroup,
+            'insertIssues': self._buildInsertIssuesGroup,
+            'numberings': self._buildNumberingsGroup,
+            'missingNumbers': self._buildMissingNumbersGroup,
+        }
+
+    def _buildGroup(self, group_name):
+        controlGroup = self.groupBuilders[group_name]()
+        main_grid, row, col, rowspan, colspan = self.groupGridPosition
+        main_grid.addWidget(controlGroup.group, row, col, rowspan, colspan)
+        self.groups[group_name] = controlGroup
+
+    def _getFilterGroup(self, parent_model, allow_no_selection=True, filter_caption='Filtra', reset_insert_caption='Reimposta', 
+        add_filter=None, add_reset_insert=None, reset_insert_signal=None):
+        if reset_insert_signal is None:
+            reset_insert_signal = self._resetFilterSignal
+        formLayout = QFormLayout()
+        formLayout.setSpacing(10)
+
+        magazineModel = MagazineListModel(self.manager, add_empty_row=allow_no_selection)
+
+        cmbMagazine = QComboBox()
+        cmbMagazine.setModel(magazineModel)
+        txtYear = QLineEdit()
+        txtNumber = QLineEdit()
+        btnFilter = QPushButton(filter_caption)
+        btnResetInsert = QPushButton(reset_insert_caption)
+
+        formLayout.addRow('Testata', cmbMagazine)
+        formLayout.addRow('Anno', txtYear)
+        formLayout.addRow('Numero', txtNumber)
+        formLayout.addRow(btnFilter, btnResetInsert)
+
+        formGroup = QGroupBox()
+        formGroup.setLayout(formLayout)
+
+        if add_filter is not None:
+            btnFilter.clicked.connect(add_filter)
+
+        btnFilter.clicked.connect(self._filterSignal(parent_model, 
+            self._generateIssueFilter, magazine_combo=cmbMagazine, year_edit=txtYear, number_edit=txtNumber))
+
+        if add_reset_insert is not None:
+            btnResetInsert.clicked.connect(add_reset_insert)
+
+        btnResetInsert.clicked.connect(reset_insert_signal(parent_model, 
+            magazine_combo=cmbMagazine, year_edit=txtYear, number_edit=txtNumber))
+
+        return formGroup, magazineModel
+
+    def _getNumberingsFilterGroup(self, parent_model):
+        formLayout = QFormLayout()
+        formLayout.setSpacing(10)
+
+        magazineModel = MagazineListModel(self.manager, add_empty_row=True)
+
+        cmbMagazine = QComboBox()
+        cmbMagazine.setModel(magazineModel)
+        txtYearFrom = QLineEdit()
+        txtYearTo = QLineEdit()
+        chkIsYearly = QCheckBox()
+        txtNumberFrom = QLineEdit()
+        txtNumberTo = QLineEdit()
+        btnFilter = QPushButton('Filtra')
+        btnInsert = QPushButton('Inserisci')
+
+        formLayout.addRow('Testata', cmbMagazine)
+        formLayout.addRow('Anno (da)', txtYearFrom)
+        formLayout.addRow('Anno (a)', txtYearTo)
+        formLayout.addRow('Numerazione annuale', chkIsYearly)
+        formLayout.addRow('Numero (da)', txtNumberFrom)
+        formLayout.addRow('Numero (a)', txtNumberTo)
+        formLayout.addRow(btnFilter, btnInsert)
+
+        formGroup = QGroupBox()
+        formGroup.setLayout(formLayout)
+
+        btnFilter.setVisible(False)
+        #btnFilter.clicked.connect(self._filterSignal(parent_model, 
+        #    self._generateIssueFilter, magazine_combo=cmbMagazine, year_edit=txtYear, number_edit=txtNumber))
+
+        btnInsert.clicked.connect(self._insertNumberingSignal(parent_model, 
+            magazine_combo=cmbMagazine, year_from_edit=txtYearFrom, year_to_edit=txtYearTo,
+            is_yearly_check=chkIsYearly, number_from_edit=txtNumberFrom, number_to_edit=txtNumberTo))
+
+        return formGroup, magazineModel
+
+    def _getMissingNumbersFilterGroup(self, parent_model):
+        formLayout = QFormLayout()
+        formLayout.setSpacing(10)
+
+        magazineModel = MagazineListModel(self.manager, add_empty_row=True, filter=Magazine.numberings.any())
+
+        cmbMagazine = QComboBox()
+        cmbMagazine.setModel(magazineModel)
+        cmbMagazine.currentIndexChanged.connect(self._selectedMagazineChanged)
+
+        formLayout.addRow('Testata', cmbMagazine)
 
-            return formGroup, magazineModel
-        #
-        #
-        #
+        formGroup = QGroupBox()
+        formGroup.setLayout(formLayout)
 
+        return formGroup, magazineModel
 
-        #
-        # welcome group
-        #
+    def _buildWelcomeGroup(self):
         welcomeLayout = QVBoxLayout()
         welcomeLayout.setSpacing(10)
         welcomeLayout.setAlignment(Qt.AlignTop)
@@ -710,47 +1049,38 @@ class Arrivista(QWidget):
 
         self.welcomeGroup = QGroupBox()
         self.welcomeGroup.setLayout(welcomeLayout)
-        self.groups.append(ControlGroup(group=self.welcomeGroup, tasks=[]))
-        #
-        #
-        #
 
+        return ControlGroup(group=self.welcomeGroup, tasks=[])
 
-        #
-        # import group
-        #
+    def _buildImportGroup(self):
         importLayout = QVBoxLayout()
         importLayout.setSpacing(10)
         importLayout.setAlignment(Qt.AlignTop)
 
         self.importMessage = QLabel('Trascina qui il file .csv contenente il catalogo aggiornato')
         importLayout.addWidget(self.importMessage, alignment=Qt.AlignHCenter)
+        self.importProgress = QProgressBar()
+        self.importProgress.setRange(0, 100)
+        self.importProgress.setVisible(False)
+        importLayout.addWidget(self.importProgress)
 
         self.importGroup = QGroupBox()
         self.importGroup.setLayout(importLayout)
-        self.groups.append(ControlGroup(group=self.importGroup, tasks=[self._resetImportMessage]))
-        #
-        #
-        #
 
+        return ControlGroup(group=self.importGroup, tasks=[self._resetImportMessage])
 
-        #
-        # view all group
-        #
+    def _buildViewAllGroup(self):
         viewAllLayout = QGridLayout()
         viewAllLayout.setSpacing(10)
 
         viewAllModel = ArrivistaTableModel(self.manager, Issue)
 
         self.viewAllTable = QTableView()
-        self.viewAllTable.setSortingEnabled(True)
-        self.viewAllTable.setModel(viewAllModel)
-        self.viewAllTable.resizeColumnsToContents()
+        self._setupTable(self.viewAllTable, viewAllModel)
 
-        btnExport = QPushButton('Esporta')
-        btnExport.clicked.connect(self._exportDataSignal(viewAllModel, self._exportData, default_filename='Lista completa {}.xlsx'))
+        btnExport = self._makeExportButton(viewAllModel, self._exportData, 'Lista completa {}.xlsx')
 
-        viewAllFormGroup, viewAllMagazineModel = getFilterGroup(viewAllModel)
+        viewAllFormGroup, viewAllMagazineModel = self._getFilterGroup(viewAllModel)
 
         viewAllLayout.addWidget(viewAllFormGroup, 0, 0, 1, 10)
         viewAllLayout.addWidget(self.viewAllTable, 1, 0, 13, 10)
@@ -758,29 +1088,21 @@ class Arrivista(QWidget):
 
         self.viewAllGroup = QGroupBox()
         self.viewAllGroup.setLayout(viewAllLayout)
-        self.groups.append(ControlGroup(group=self.viewAllGroup, tasks=[viewAllModel.resetConnection, viewAllMagazineModel.resetConnection]))
-        #
-        #
-        #
 
+        return ControlGroup(group=self.viewAllGroup, tasks=[self._refreshTableSignal(self.viewAllTable, viewAllModel), viewAllMagazineModel.resetConnection])
 
-        #
-        # view duplicates group
-        #
+    def _buildViewDuplicatesGroup(self):
         viewDuplicatesLayout = QGridLayout()
         viewDuplicatesLayout.setSpacing(10)
 
-        viewDuplicatesModel = ArrivistaTableModel(self.manager, Issue, filter=lambda x: x.copies > 1)
+        viewDuplicatesModel = ArrivistaTableModel(self.manager, Issue, filter=Issue.copies > 1)
 
         self.viewDuplicatesTable = QTableView()
-        self.viewDuplicatesTable.setSortingEnabled(True)
-        self.viewDuplicatesTable.setModel(viewDuplicatesModel)
-        self.viewDuplicatesTable.resizeColumnsToContents()
+        self._setupTable(self.viewDuplicatesTable, viewDuplicatesModel)
 
-        btnExport = QPushButton('Esporta')
-        btnExport.clicked.connect(self._exportDataSignal(viewDuplicatesModel, self._exportData, default_filename='Duplicati {}.xlsx'))
+        btnExport = self._makeExportButton(viewDuplicatesModel, self._exportData, 'Duplicati {}.xlsx')
 
-        viewDuplicatesFormGroup, viewDuplicatesMagazineModel = getFilterGroup(viewDuplicatesModel)
+        viewDuplicatesFormGroup, viewDuplicatesMagazineModel = self._getFilterGroup(viewDuplicatesModel)
 
         viewDuplicatesLayout.addWidget(viewDuplicatesFormGroup, 0, 0, 1, 10)
         viewDuplicatesLayout.addWidget(self.viewDuplicatesTable, 1, 0, 13, 10)
@@ -788,29 +1110,21 @@ class Arrivista(QWidget):
 
         self.viewDuplicatesGroup = QGroupBox()
         self.viewDuplicatesGroup.setLayout(viewDuplicatesLayout)
-        self.groups.append(ControlGroup(group=self.viewDuplicatesGroup, tasks=[viewDuplicatesModel.resetConnection, viewDuplicatesMagazineModel.resetConnection]))
-        #
-        #
-        #
 
+        return ControlGroup(group=self.viewDuplicatesGroup, tasks=[self._refreshTableSignal(self.viewDuplicatesTable, viewDuplicatesModel), viewDuplicatesMagazineModel.resetConnection])
 
-        #
-        # view new group
-        #
+    def _buildViewNewGroup(self):
         viewNewLayout = QGridLayout()
         viewNewLayout.setSpacing(10)
 
-        viewNewModel = ArrivistaTableModel(self.manager, Issue, filter=lambda x: x.is_new)
+        viewNewModel = ArrivistaTableModel(self.manager, Issue, filter=Issue.is_new == True)
 
         self.viewNewTable = QTableView()
-        self.viewNewTable.setSortingEnabled(True)
-        self.viewNewTable.setModel(viewNewModel)
-        self.viewNewTable.resizeColumnsToContents()
+        self._setupTable(self.viewNewTable, viewNewModel)
 
-        btnExport = QPushButton('Esporta')
-        btnExport.clicked.connect(self._exportDataSignal(viewNewModel, self._exportData, default_filename='Nuovi {}.xlsx'))
+        btnExport = self._makeExportButton(viewNewModel, self._exportData, 'Nuovi {}.xlsx')
 
-        viewNewFormGroup, viewNewMagazineModel = getFilterGroup(viewNewModel)
+        viewNewFormGroup, viewNewMagazineModel = self._getFilterGroup(viewNewModel)
 
         viewNewLayout.addWidget(viewNewFormGroup, 0, 0, 1, 10)
         viewNewLayout.addWidget(self.viewNewTable, 1, 0, 13, 10)
@@ -818,27 +1132,20 @@ class Arrivista(QWidget):
 
         self.viewNewGroup = QGroupBox()
         self.viewNewGroup.setLayout(viewNewLayout)
-        self.groups.append(ControlGroup(group=self.viewNewGroup, tasks=[viewNewModel.resetConnection, viewNewMagazineModel.resetConnection]))
-        #
-        #
-        #
 
+        return ControlGroup(group=self.viewNewGroup, tasks=[self._refreshTableSignal(self.viewNewTable, viewNewModel), viewNewMagazineModel.resetConnection])
 
-        #
-        # insert issues group
-        #
+    def _buildInsertIssuesGroup(self):
         insertIssuesLayout = QGridLayout()
         insertIssuesLayout.setSpacing(10)
 
         insertIssuesModel = ArrivistaTableModel(self.manager, Issue)
 
         self.insertIssuesTable = QTableView()
-        self.insertIssuesTable.setSortingEnabled(False)
-        self.insertIssuesTable.setModel(insertIssuesModel)
-        self.insertIssuesTable.resizeColumnsToContents()
+        self._setupTable(self.insertIssuesTable, insertIssuesModel, sorting_enabled=False)
         self.insertIssuesTable.setVisible(False)
 
-        insertIssuesFormGroup, insertIssuesMagazineModel = getFilterGroup(insertIssuesModel,
+        insertIssuesFormGroup, insertIssuesMagazineModel = self._getFilterGroup(insertIssuesModel,
             allow_no_selection=False, filter_caption='Controlla', reset_insert_caption='Inserisci',
             add_filter=self._setVisibilitySignal(self.insertIssuesTable, True),
             reset_insert_signal=self._insertIssueSignal)
@@ -848,82 +1155,41 @@ class Arrivista(QWidget):
 
         self.insertIssuesGroup = QGroupBox()
         self.insertIssuesGroup.setLayout(insertIssuesLayout)
-        self.groups.append(ControlGroup(group=self.insertIssuesGroup, tasks=[insertIssuesModel.resetConnection, insertIssuesMagazineModel.resetConnection]))
-        #
-        #
-        #
 
+        return ControlGroup(group=self.insertIssuesGroup, tasks=[self._refreshTableSignal(self.insertIssuesTable, insertIssuesModel), insertIssuesMagazineModel.resetConnection])
 
-        #
-        # numberings group
-        #
+    def _buildNumberingsGroup(self):
         numberingsLayout = QGridLayout()
         numberingsLayout.setSpacing(10)
 
         numberingsModel = ArrivistaTableModel(self.manager, Numbering)
 
         self.numberingsTable = QTableView()
-        self.numberingsTable.setSortingEnabled(True)
-        self.numberingsTable.setModel(numberingsModel)
-        self.numberingsTable.resizeColumnsToContents()
+        self._setupTable(self.numberingsTable, numberingsModel)
 
-        numberingsFormGroup, numberingsMagazineModel = getNumberingsFilterGroup(numberingsModel)
+        numberingsFormGroup, numberingsMagazineModel = self._getNumberingsFilterGroup(numberingsModel)
 
         numberingsLayout.addWidget(numberingsFormGroup, 0, 0, 1, 10)
         numberingsLayout.addWidget(self.numberingsTable, 1, 0, 13, 10)
 
         self.numberingsGroup = QGroupBox()
         self.numberingsGroup.setLayout(numberingsLayout)
-        self.groups.append(ControlGroup(group=self.numberingsGroup, tasks=[numberingsModel.resetConnection, numberingsMagazineModel.resetConnection]))
-        #
-        #
-        #
-
 
-        #
-        # numberings group
-        #
-        numberingsLayout = QGridLayout()
-        numberingsLayout.setSpacing(10)
+        return ControlGroup(group=self.numberingsGroup, tasks=[self._refreshTableSignal(self.numberingsTable, numberingsModel), numberingsMagazineModel.resetConnection])
 
-        numberingsModel = ArrivistaTableModel(self.manager, Numbering)
-
-        self.numberingsTable = QTableView()
-        self.numberingsTable.setSortingEnabled(True)
-        self.numberingsTable.setModel(numberingsModel)
-        self.numberingsTable.resizeColumnsToContents()
-
-        numberingsFormGroup, numberingsMagazineModel = getNumberingsFilterGroup(numberingsModel)
-
-        numberingsLayout.addWidget(numberingsFormGroup, 0, 0, 1, 10)
-        numberingsLayout.addWidget(self.numberingsTable, 1, 0, 13, 10)
-
-        self.numberingsGroup = QGroupBox()
-        self.numberingsGroup.setLayout(numberingsLayout)
-        self.groups.append(ControlGroup(group=self.numberingsGroup, tasks=[numberingsModel.resetConnection, numberingsMagazineModel.resetConnection]))
-        #
-        #
-        #
-
-
-        #
-        # missing numbers group
-        #
+    def _buildMissingNumbersGroup(self):
         missingNumbersLayout = QGridLayout()
         missingNumbersLayout.setSpacing(10)
 
         self.missingNumbersModel = MissingNumbersTableModel(self.manager)
 
         self.missingNumbersTable = QTableView()
-        self.missingNumbersTable.setSortingEnabled(False)
-        self.missingNumbersTable.setModel(self.missingNumbersModel)
-        self.missingNumbersTable.resizeColumnsToContents()
+        self._setupTable(self.missingNumbersTable, self.missingNumbersModel, sorting_enabled=False)
         self.missingNumbersTable.setVisible(False)
 
-        missingNumbersFormGroup, self.missingNumbersMagazineModel = getMissingNumbersFilterGroup(self.missingNumbersModel)
+        missingNumbersFormGroup, self.missingNumbersMagazineModel = self._getMissingNumbersFilterGroup(self.missingNumbersModel)
 
-        btnExport = QPushButton('Esporta')
-        btnExport.clicked.connect(self._exportMissingNumbersSignal(self.missingNumbersModel, self._exportMissingNumbers, default_filename=' numeri mancanti {}.xlsx'))
+        btnExport = self._makeExportButton(self.missingNumbersModel, self._exportMissingNumbers, ' numeri mancanti {}.xlsx')
 
         missingNumbersLayout.addWidget(missingNumbersFormGroup, 0, 0, 1, 10)
         missingNumbersLayout.addWidget(self.missingNumbersTable, 1, 0, 13, 10)
@@ -931,16 +1197,9 @@ class Arrivista(QWidget):
 
         self.missingNumbersGroup = QGroupBox()
         self.missingNumbersGroup.setLayout(missingNumbersLayout)
-        self.groups.append(ControlGroup(group=self.missingNumbersGroup, tasks=[self.missingNumbersModel.resetConnection, self.missingNumbersMagazineModel.resetConnection]))
-        #
-        #
-        #
 
+        return ControlGroup(group=self.missingNumbersGroup, tasks=[self._refreshTableSignal(self.missingNumbersTable, self.missingNumbersModel), self.missingNumbersMagazineModel.resetConnection])
 
-        # add all groups in the same grid position
-        for controlGroup in self.groups:
-            main_grid.addWidget(controlGroup.group, row, col, rowspan, colspan)
-                
     def _initUI(self, title):
 
         # set main window properties
@@ -977,13 +1236,13 @@ class Arrivista(QWidget):
         menuLayout.addWidget(btnNumberings)
         grid.addWidget(menu, 0, 0, 10, 3)
 
-        btnImport.clicked.connect(self._showGroupSignal(self.importGroup, btnImport))
-        btnViewAll.clicked.connect(self._showGroupSignal(self.viewAllGroup, btnViewAll))
-        btnViewDuplicates.clicked.connect(self._showGroupSignal(self.viewDuplicatesGroup, btnViewDuplicates))
-        btnViewNew.clicked.connect(self._showGroupSignal(self.viewNewGroup, btnViewNew))
-        btnViewMissing.clicked.connect(self._showGroupSignal(self.missingNumbersGroup, btnViewMissing))
-        btnInsertIssues.clicked.connect(self._showGroupSignal(self.insertIssuesGroup, btnInsertIssues))
-        btnNumberings.clicked.connect(self._showGroupSignal(self.numberingsGroup, btnNumberings))
+        btnImport.clicked.connect(self._showGroupSignal('import', btnImport))
+        btnViewAll.clicked.connect(self._showGroupSignal('viewAll', btnViewAll))
+        btnViewDuplicates.clicked.connect(self._showGroupSignal('viewDuplicates', btnViewDuplicates))
+        btnViewNew.clicked.connect(self._showGroupSignal('viewNew', btnViewNew))
+        btnViewMissing.clicked.connect(self._showGroupSignal('missingNumbers', btnViewMissing))
+        btnInsertIssues.clicked.connect(self._showGroupSignal('insertIssues', btnInsertIssues))
+        btnNumberings.clicked.connect(self._showGroupSignal('numberings', btnNumberings))
 
         # add buttons to list and modify palette
         buttonPalette = QPalette(btnImport.palette())
@@ -992,10 +1251,10 @@ class Arrivista(QWidget):
             btn.setAutoFillBackground(True)
             btn.setFlat(True)
             btn.setPalette(buttonPalette)
-            btn.update()
+            btn.setStyleSheet(self.SIDEBAR_BUTTON_STYLE)
 
         # show welcome group
-        self._showGroup(self.welcomeGroup)
+        self._showGroup('welcome')
 
         # show main window
         self.show()
@@ -1008,19 +1267,39 @@ class Arrivista(QWidget):
         self.move(qr.topLeft())
 
     def dragEnterEvent(self, e):
-        if self.importGroup.isVisible():
+        if 'import' in self.groups and self.importGroup.isVisible():
             e.accept()
 
     def dropEvent(self, e):
-        if e.mimeData().hasText():
-            filePath = e.mimeData().text()[7:]
-            # Windows fix
-            if filePath[2] == ':':
-                filePath = filePath[1:]
+        if e.mimeData().hasUrls():
+            # local path of the dropped file, with the right drive letter and separators on Windows
+            filePath = e.mimeData().urls()[0].toLocalFile()
             self.importMessage.setText("Importazione in corso dal file {}, attendi...".format(filePath.split('/')[-1]))
-            self.update()
-            m, ni, ui, di = self.manager.update_archive_from_csv(filePath)
-            self.importMessage.setText("Importazione conclusa:\n{} nuove testate, {} nuovi numeri, {} numeri aggiornati e {} numeri eliminati.".format(m, ni, ui, di))
+            self.importProgress.setValue(0)
+            self.importProgress.setVisible(True)
+            # no other drops until this import is over
+            self.setAcceptDrops(False)
+            self.importThread = QThread(self)
+            self.importWorker = ImportWorker(self.manager, filePath)
+            self.importWorker.moveToThread(self.importThread)
+            self.importThread.started.connect(self.importWorker.run)
+            self.importWorker.progress.connect(self.importProgress.setValue)
+            # quit directly from the worker thread, the gui thread waits for it in _endImport
+            self.importWorker.finished.connect(self.importThread.quit, Qt.DirectConnection)
+            self.importWorker.failed.connect(self.importThread.quit, Qt.DirectConnection)
+            self.importWorker.finished.connect(self._importFinished)
+            self.importWorker.failed.connect(self._importFailed)
+            # both are disposed of once the thread is over
+            self.importThread.finished.connect(self.importWorker.deleteLater)
+            self.importThread.finished.connect(self.importThread.deleteLater)
+            self.importThread.start()
+
+    def closeEvent(self, e):
+        if self.importThread is not None:
+            self.importThread.wait()
+        for thread in self.exportThreads:
+            thread.wait()
+        super().closeEvent(e)
 
     def _old_NOUSE(self):
         # create all widgets for main grid
@@ -1,83 +1,82 @@
 # coding: utf-8
 import os
+import re
 import sys
 import contextlib
-from sqlalchemy import (Column, ForeignKey,
-    Integer, String, Boolean, UniqueConstraint, Date)
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from collections import namedtuple
+from itertools import product
+from sqlalchemy import (Column, ForeignKey, Index,
+    Integer, String, Boolean, UniqueConstraint, Date, select, event, inspect)
+from sqlalchemy.orm import declarative_base, relationship, object_session
 from sqlalchemy.sql import default_comparator
 from sqlalchemy import create_engine
  
 Base = declarative_base()
 
-# string parsing constants
-STATE_PREFIX = 0
-STATE_NUMBER = 1
-STATE_SEPARATOR = 2
-STATE_SUFFIX = 3
-
-def _check_min_max(num, min, max):
-    new_min = min if min is not None and num >= min else num
-    new_max = max if max is not None and num <= max else num
-    return new_min, new_max
-
-def _check_prev(cur, prev):
-    return cur, cur < prev
-
-def _check_year_in_interval(year, min, max):
-    return (min is None or year >= min) and (max is None or year <= max)
-
-def _get_min_year(issues):
-    return min(issue.year for issue in issues)
-
-def _get_max_year(issues):
-    return max(issue.year for issue in issues)
-
-def _get_min_number(issues):
-    return min(issue.num_min for issue in issues if issue.num_min is not None)
-
-def _get_max_number(issues):
-    return max(issue.num_max for issue in issues if issue.num_max is not None)
-
-def _contains_issue(issues, year, number):
-    return next((True for issue in issues if issue.num_min is not None and issue.num_max is not None
-        and issue.num_min <= number <= issue.num_max and (year is None or issue.year == year)), False)
+# string parsing patterns: an optional prefix, a list of numbers separated by '-' or '/'
+# (anything but digits is skipped after a separator) and an optional suffix
+ISSUE_NUMBER_RE = re.compile(r'\D*(\d+)((?:[-/]\D*\d+)*)(?:[-/]\D*\Z|(.*))', re.S)
+NUMBER_RE = re.compile(r'\d+')
+
+IssueStats = namedtuple('IssueStats', 'min_year max_year min_number max_number')
+
+def _get_issue_stats(issues):
+    min_year = max_year = min_number = max_number = None
+    for issue in issues:
+        year = issue.year
+        if min_year is None or year < min_year:
+            min_year = year
+        if max_year is None or year > max_year:
+            max_year = year
+        if issue.num_min is not None and (min_number is None or issue.num_min < min_number):
+            min_number = issue.num_min
+        if issue.num_max is not None and (max_number is None or issue.num_max > max_number):
+            max_number = issue.num_max
+    return IssueStats(min_year, max_year, min_number, max_number)
+
+def _get_issue_intervals(issues):
+    return [(issue.year, issue.num_min, issue.num_max) for issue in issues
+        if issue.num_min is not None and issue.num_max is not None]
+
+def _missing_numbers_kernel(years, from_number, to_number, intervals):
+    # one byte per (year, number) cell of the numbering grid, set for the cells covered by an issue;
+    # years is (None,) for numberings that are not yearly, where any issue covers its numbers
+    width = to_number - from_number + 1
+    if width <= 0 or len(years) == 0:
+        return []
+    yearly = years[0] is not None
+    offsets = {year: row*width - from_number for row, year in enumerate(years)}
+    covered = bytearray(width * len(years))
+    for year, num_min, num_max in intervals:
+        offset = offsets.get(year) if yearly else -from_number
+        if offset is None:
+            continue
+        if num_min < from_number:
+            num_min = from_number
+        if num_max > to_number:
+            num_max = to_number
+        if num_min == num_max:
+            covered[offset + num_min] = 1
+        elif num_min < num_max:
+            covered[offset + num_min:offset + num_max + 1] = b'\x01' * (num_max - num_min + 1)
+    missing = []
+    i = covered.find(0)
+    while i != -1:
+        missing.append((years[i // width], from_number + i % width))
+        i = covered.find(0, i + 1)
+    return missing
 
 def extract_issue_numbers(s):
     if len(s) == 0:
-        return None, None, None
-    state = STATE_PREFIX
-    cur, prev = 0, 0
-    min, max = None, None
-    inv = False
-    suffix = ''
-    for c in s:
-        if state == STATE_SUFFIX:
-            suffix += c
-        elif c.isdigit():
-            if state == STATE_PREFIX or state == STATE_SEPARATOR:
-                state = STATE_NUMBER
-                cur = int(c)
-            elif state == STATE_NUMBER:
-                cur = cur*10 + int(c)
-        elif c == '/' or c == '-':
-            if state == STATE_NUMBER:
-                state = STATE_SEPARATOR
-                min, max = _check_min_max(cur, min, max)
-                prev, inv = _check_prev(cur, prev)
-        else:
-            if state == STATE_NUMBER:
-                state = STATE_SUFFIX
-                suffix = c
-                min, max = _check_min_max(cur, min, max)
-                prev, inv = _check_prev(cur, prev)
-
-    if state == STATE_NUMBER:
-        min, max = _check_min_max(cur, min, max)
-        prev, inv = _check_prev(cur, prev)
-
-    return min, max, inv, suffix.strip()
+        return None, None, None, ''
+    m = ISSUE_NUMBER_RE.match(s)
+    if m is None:
+        return None, None, False, ''
+    first = int(m.group(1))
+    if len(m.group(2)) == 0:
+        return first, first, False, (m.group(3) or '').strip()
+    numbers = [first] + [int(n) for n in NUMBER_RE.findall(m.group(2))]
+    return min(numbers), max(numbers), numbers[-1] < numbers[-2], (m.group(3) or '').strip()
 
  
 class Magazine(Base):
@@ -101,29 +100,43 @@ class Magazine(Base):
         return "<Magazine(name='{}')>".format(self.name)
 
     def get_current_issues_for_numbering(self, numbering):
-        from_year = None if numbering.from_year is None else numbering.from_year
-        to_year = None if numbering.to_year is None else numbering.to_year
-        return [issue for issue in self.issues if _check_year_in_interval(issue.year, from_year, to_year)]
+        # let sqlite pick the issues in the numbering years, through the (magazine_id, year, ...) index;
+        # only the columns needed to compute missing numbers are loaded
+        stmt = select(Issue.year, Issue.num_min, Issue.num_max).where(Issue.magazine_id == self.id)
+        if numbering.from_year is not None:
+            stmt = stmt.where(Issue.year >= numbering.from_year)
+        if numbering.to_year is not None:
+            stmt = stmt.where(Issue.year <= numbering.to_year)
+        return object_session(self).execute(stmt.order_by(Issue.id)).all()
+
+    def _get_numbering_grid(self, numbering, current_issues):
+        # bounds missing from the numbering are taken from the issues, in a single pass
+        stats = None
+        if numbering.is_yearly:
+            if numbering.from_year is None or numbering.to_year is None:
+                stats = _get_issue_stats(current_issues)
+            from_year = stats.min_year if numbering.from_year is None else numbering.from_year
+            to_year = stats.max_year if numbering.to_year is None else numbering.to_year
+            from_number = 1 if numbering.from_number is None else numbering.from_number
+            to_number = 12 if numbering.to_number is None else numbering.to_number
+            return range(from_year, to_year+1), from_number, to_number
+
+        if numbering.from_number is None or numbering.to_number is None:
+            stats = _get_issue_stats(current_issues)
+        from_number = stats.min_number if numbering.from_number is None else numbering.from_number
+        to_number = stats.max_number if numbering.to_number is None else numbering.to_number
+        return (None,), from_number, to_number
 
     def get_all_issues_for_numbering(self, numbering, current_issues=None):
         if current_issues is None:
             current_issues = self.get_current_issues_for_numbering(numbering)
-
-        if numbering.is_yearly:
-            from_year = _get_min_year(current_issues) if numbering.from_year is None else numbering.from_year
-            to_year = _get_max_year(current_issues) if numbering.to_year is None else numbering.to_year
-            from_number = 1 if numbering.from_number is None else numbering.from_number
-            to_number = 12 if numbering.to_number is None else numbering.to_number
-            return [(year, number) for year in range(from_year, to_year+1) for number in range(from_number, to_number+1)]
-        
-        from_number = _get_min_number(current_issues) if numbering.from_number is None else numbering.from_number
-        to_number = _get_max_number(current_issues) if numbering.to_number is None else numbering.to_number
-        return [(None, number) for number in range(from_number, to_number+1)]
+        years, from_number, to_number = self._get_numbering_grid(numbering, current_issues)
+        return list(product(years, range(from_number, to_number+1)))
 
     def _get_missing_numbers(self, numbering):
         current_issues = self.get_current_issues_for_numbering(numbering)
-        all_numbers = self.get_all_issues_for_numbering(numbering, current_issues)
-        return [number for number in all_numbers if not _contains_issue(current_issues, number[0], number[1])]
+        years, from_number, to_number = self._get_numbering_grid(numbering, current_issues)
+        return _missing_numbers_kernel(years, from_number, to_number, _get_issue_intervals(current_issues))
 
     def get_missing_numbers(self):
         missing_numbers = []
@@ -137,14 +150,14 @@ class Issue(Base):
     id = Column(Integer, primary_key=True)
     year = Column(Integer)
     issue_number = Column(String(250), nullable=False)
-    copies = Column(Integer, nullable=False)
+    copies = Column(Integer, nullable=False, index=True)
     is_new = Column(Boolean, nullable=False)
     magazine_id = Column(Integer, ForeignKey('magazine.id'))
     num_min = Column(Integer)
     num_max = Column(Integer)
     inv = Column(Boolean)
     suffix = Column(String(250))
-    magazine = relationship("Magazine", back_populates="issues")
+    magazine = relationship("Magazine", back_populates="issues", lazy="joined")
 
     show_columns = ('magazine.name', 'year', 'issue_number', 'copies', 'is_new')
     column_names = ('testata', 'anno', 'numero', 'copie', 'nuovo')
@@ -154,8 +167,10 @@ class Issue(Base):
     filter_columns = (True, True, True, True, True)
     edit_columns = (False, True, True, True, False)
 
+    # the unique constraint index also serves lookups by magazine_id and (magazine_id, year)
     __table_args__ = (
         UniqueConstraint("magazine_id", "year", "issue_number"),
+        Index("ix_issue_new", "is_new", "magazine_id"),
     )
 
     def populate_issue_numbers(self):
@@ -175,7 +190,7 @@ class Numbering(Base):
     is_yearly = Column(Boolean, nullable=False)
     from_number = Column(Integer)
     to_number = Column(Integer)
-    magazine = relationship("Magazine", back_populates="numberings")
+    magazine = relationship("Magazine", back_populates="numberings", lazy="joined")
 
     show_columns = ('magazine.name', 'from_year', 'to_year', 'is_yearly', 'from_number', 'to_number')
     column_names = ('testata', 'data inizio', 'data fine', 'annuale', 'da', 'a')
@@ -192,3 +207,15 @@ class Numbering(Base):
 
 Magazine.issues = relationship("Issue", order_by=Issue.id, back_populates="magazine")
 Magazine.numberings = relationship("Numbering", order_by=Numbering.id, back_populates="magazine")
+
+
+# keep the parsed number columns in sync with issue_number whenever the orm writes an issue
+# (bulk inserts, like the csv import, set them explicitly)
+@event.listens_for(Issue, 'before_insert')
+def _populate_inserted_issue_numbers(mapper, connection, target):
+    target.populate_issue_numbers()
+
+@event.listens_for(Issue, 'before_update')
+def _populate_updated_issue_numbers(mapper, connection, target):
+    if inspect(target).attrs.issue_number.history.has_changes():
+        target.populate_issue_numbers()